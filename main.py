@@ -2,13 +2,14 @@ import asyncio
 import logging
 import os
 
+import httpx
 import pandas as pd
 from dotenv import load_dotenv
 from llama_index.llms.openai import OpenAI
 
 from src.agent.pydantics import SQLAgentOutput
 from src.agent.router import SQLAgent
-from src.db.database import session_scope
+from src.db.database import async_session_scope, init_db
 
 # log to file temp.log
 logging.basicConfig(level=logging.INFO, filename="temp.log")
@@ -18,20 +19,44 @@ load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+try:
+    import uvloop
+except ImportError:  # uvloop doesn't support Windows
+    uvloop = None
+
+# Shared by every async invocation so the concurrent structured invocations reuse
+# warm connections and are multiplexed over HTTP/2
+HTTP_CLIENT = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+    timeout=60,
+)
+
 
 async def invoke_agent(user_input: str) -> None:
-    with session_scope() as session:
-        llm = OpenAI(temperature=0.1, model="gpt-4o-mini", api_key=OPENAI_API_KEY)
-        agent = SQLAgent(llm=llm, session=session)
-        result: SQLAgentOutput = await agent.run(input=user_input)
-        print(result.text)
-        if isinstance(result.results_df, pd.DataFrame):
-            print(result.results_df.shape)
+    try:
+        async with async_session_scope() as session:
+            llm = OpenAI(
+                temperature=0.1,
+                model="gpt-4o-mini",
+                api_key=OPENAI_API_KEY,
+                async_http_client=HTTP_CLIENT,
+            )
+            agent = SQLAgent(llm=llm, session=session)
+            result: SQLAgentOutput = await agent.run(input=user_input)
+            print(result.text)
+            if isinstance(result.results_df, pd.DataFrame):
+                print(result.results_df.shape)
+    finally:
+        # Close on the loop the client's connections were opened on
+        await HTTP_CLIENT.aclose()
 
 
 def main():
+    init_db()
     user_input = input("Enter your query: ")
-    asyncio.run(invoke_agent(user_input))
+    run = uvloop.run if uvloop else asyncio.run
+    run(invoke_agent(user_input))
 
 
 if __name__ == "__main__":
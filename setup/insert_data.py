@@ -1,14 +1,18 @@
 import argparse
 import os
 import sys
+import uuid
+from collections import defaultdict
+from collections.abc import Iterator
 from datetime import datetime
 
 import numpy as np
+from sqlalchemy.orm import Session
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from src.db import models
-from src.db.database import session_scope
+from src.db.database import bulk_insert, init_db, session_scope
 
 SECTORS = [
     "Technology",
@@ -23,108 +27,172 @@ SECTORS = [
     "Entertainment",
 ]
 
+RNG = np.random.default_rng()
+
 
 def create_firms(n: int):
-    firms: list[models.Firms] = []
+    sectors: list[str] = RNG.choice(SECTORS, size=n).tolist()
+
+    firms: list[dict] = []
     for i in range(n):
-        firm = models.Firms(
-            name=f"Firm {i}",
-            sector=np.random.choice(SECTORS),
-        )
+        firm = {
+            "name": f"Firm {i}",
+            "sector": sectors[i],
+        }
         firms.append(firm)
 
     with session_scope() as session:
-        session.add_all(firms)
+        bulk_insert(session, models.Firms, firms)
         session.commit()
 
 
 def create_contacts(n: int):
     with session_scope() as session:
         firms = session.query(models.Firms).all()
+        firm_idx = RNG.integers(0, len(firms), n)
 
-        contacts: list[models.Contacts] = []
+        contacts: list[dict] = []
         for i in range(n):
-            contact = models.Contacts(
-                name=f"Contact {i}",
-                email=f"email {i}",
-                firm_id=np.random.choice(firms).firm_id,
-            )
+            contact = {
+                "name": f"Contact {i}",
+                "email": f"email {i}",
+                "firm_id": firms[firm_idx[i]].firm_id,
+            }
             contacts.append(contact)
 
-        session.add_all(contacts)
+        bulk_insert(session, models.Contacts, contacts)
         session.commit()
 
 
 def create_employees(n: int):
-    employees: list[models.Employees] = []
+    employees: list[dict] = []
     for i in range(n):
-        employee = models.Employees(
-            name=f"Employee {i}",
-            email=f"email {i}",
-        )
+        employee = {
+            "name": f"Employee {i}",
+            "email": f"email {i}",
+        }
         employees.append(employee)
 
     with session_scope() as session:
-        session.add_all(employees)
+        bulk_insert(session, models.Employees, employees)
         session.commit()
 
 
-def create_meetings(n: int):
-    with session_scope() as session:
-        firms = session.query(models.Firms).all()
-        employees = session.query(models.Employees).all()
+MeetingSample = tuple[
+    models.Firms,
+    list[models.Firms],
+    list[models.Contacts],
+    list[models.Employees],
+    datetime,
+]
 
-        meetings: list[models.Meetings] = []
-        for i in range(n):
-            firm_attended = np.random.choice(firms)
-            size = np.random.randint(
-                0, min([5, len([x for x in firms if x != firm_attended])])
-            )
-            if size > 0:
-                firms_discussed = np.random.choice(
-                    [x for x in firms if x != firm_attended], size=size, replace=False
-                ).tolist()
-            else:
-                firms_discussed = []
-
-            firm_contacts = (
-                session.query(models.Contacts)
-                .filter(models.Contacts.firm_id == firm_attended.firm_id)
-                .all()
-            )
-            if len(firm_contacts) > 0:
-                size = np.random.randint(0, min([3, len(firm_contacts)]))
-                if size > 0:
-                    contacts = np.random.choice(
-                        firm_contacts, size=size, replace=False
-                    ).tolist()
-                else:
-                    contacts = []
-            else:
-                contacts = []
-
-            employees_attending = np.random.choice(
-                employees,
-                size=np.random.randint(1, min([4, len(employees)])),
-                replace=False,
-            ).tolist()
-
-            meeting = models.Meetings(
-                title=f"Meeting {i}",
-                content=f"Content {i}",
-                date=datetime(
-                    np.random.randint(2019, 2026),
-                    np.random.randint(1, 13),
-                    np.random.randint(1, 29),
-                ),
-                firm_attended=firm_attended,
-                contacts=contacts,
-                employees=employees_attending,
-                firms_discussed=firms_discussed,
+
+def sample_meetings(session: Session, n: int) -> Iterator[MeetingSample]:
+    firms = session.query(models.Firms).all()
+    employees = session.query(models.Employees).all()
+
+    contacts_by_firm: dict[uuid.UUID, list[models.Contacts]] = defaultdict(list)
+    for contact in session.query(models.Contacts).all():
+        contacts_by_firm[contact.firm_id].append(contact)
+
+    # Draw every meeting's scalar samples up-front in single vectorized calls
+    firm_attended_idx = RNG.integers(0, len(firms), n)
+    n_firms_discussed = RNG.integers(0, min([5, len(firms) - 1]), n)
+    contacts_fraction = RNG.random(n)
+    n_employees_attending = RNG.integers(1, min([4, len(employees)]), n)
+    years = RNG.integers(2019, 2026, n)
+    months = RNG.integers(1, 13, n)
+    days = RNG.integers(1, 29, n)
+    dates: list[datetime] = (
+        (
+            ((years - 1970) * 12 + months - 1).astype("datetime64[M]")
+            + (days - 1).astype("timedelta64[D]")
+        )
+        .astype("datetime64[us]")
+        .tolist()
+    )
+
+    for i in range(n):
+        firm_attended = firms[firm_attended_idx[i]]
+        # Sample the other firms by drawing from len(firms) - 1 slots and
+        # shifting indices at or past the attended firm up by one
+        discussed_idx = RNG.choice(
+            len(firms) - 1, size=n_firms_discussed[i], replace=False
+        )
+        discussed_idx[discussed_idx >= firm_attended_idx[i]] += 1
+        firms_discussed = [firms[j] for j in discussed_idx]
+
+        firm_contacts = contacts_by_firm.get(firm_attended.firm_id, [])
+        size = int(contacts_fraction[i] * min([3, len(firm_contacts)]))
+        contacts = [
+            firm_contacts[j]
+            for j in RNG.choice(len(firm_contacts), size=size, replace=False)
+        ]
+
+        employees_attending = [
+            employees[j]
+            for j in RNG.choice(
+                len(employees), size=n_employees_attending[i], replace=False
             )
-            meetings.append(meeting)
+        ]
+
+        yield firm_attended, firms_discussed, contacts, employees_attending, dates[i]
+
+
+def meeting_link_rows(
+    meeting_id: uuid.UUID,
+    firms_discussed: list[models.Firms],
+    contacts: list[models.Contacts],
+    employees_attending: list[models.Employees],
+) -> tuple[list[dict], list[dict], list[dict]]:
+    meeting_firms = [
+        {"meeting_id": meeting_id, "firm_id": x.firm_id} for x in firms_discussed
+    ]
+    meeting_contacts = [
+        {"meeting_id": meeting_id, "contact_id": x.contact_id} for x in contacts
+    ]
+    meeting_employees = [
+        {"meeting_id": meeting_id, "employee_id": x.employee_id}
+        for x in employees_attending
+    ]
+    return meeting_firms, meeting_contacts, meeting_employees
+
 
-        session.add_all(meetings)
+def create_meetings(n: int):
+    with session_scope() as session:
+        meetings: list[dict] = []
+        meeting_firms: list[dict] = []
+        meeting_contacts: list[dict] = []
+        meeting_employees: list[dict] = []
+
+        for i, sample in enumerate(sample_meetings(session, n)):
+            firm_attended, firms_discussed, contacts, employees_attending, date = sample
+
+            # Assigned client-side so the link rows can reference it without RETURNING
+            meeting_id = uuid.uuid4()
+            meeting = {
+                "meeting_id": meeting_id,
+                "title": f"Meeting {i}",
+                "content": f"Content {i}",
+                "date": date,
+                "firm_attended_id": firm_attended.firm_id,
+            }
+            meetings.append(meeting)
+            firms_rows, contacts_rows, employees_rows = meeting_link_rows(
+                meeting_id, firms_discussed, contacts, employees_attending
+            )
+            meeting_firms.extend(firms_rows)
+            meeting_contacts.extend(contacts_rows)
+            meeting_employees.extend(employees_rows)
+
+        bulk_insert(session, models.Meetings, meetings)
+        bulk_insert(session, models.meetings_firms_discussed_association, meeting_firms)
+        bulk_insert(
+            session, models.contacts_attended_meetings_association, meeting_contacts
+        )
+        bulk_insert(
+            session, models.employees_attended_meetings_association, meeting_employees
+        )
         session.commit()
 
 
@@ -134,6 +202,7 @@ def main(
     n_employees: int,
     n_meetings: int,
 ):
+    init_db()
     create_firms(n_firms)
     create_contacts(n_contacts)
     create_employees(n_employees)
@@ -1,24 +1,30 @@
 import argparse
 import asyncio
+import itertools
 import json
 import os
 import sys
+import time
+import uuid
 from datetime import datetime
 from textwrap import dedent
 
+import httpx
 import numpy as np
 from dotenv import load_dotenv
 from faker import Faker
 from llama_index.core import PromptTemplate
 from llama_index.llms.openai import OpenAI
+from openai import RateLimitError
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import RetryCallState, retry, stop_after_attempt, wait_exponential
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
+from setup.insert_data import meeting_link_rows, sample_meetings
 from src.db import models
-from src.db.database import session_scope
+from src.db.database import bulk_insert, copy_insert, init_db, session_scope
 
 load_dotenv()
 
@@ -26,30 +32,104 @@ FAKER = Faker()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 LLM_MODEL = "gpt-4o-mini"
 MAX_TOKENS_SYNTHETIC_SAMPLES = 300
+# Account quota for LLM_MODEL, requests are paced to stay under both limits
+LLM_REQUESTS_PER_MINUTE = 500
+LLM_TOKENS_PER_MINUTE = 200_000
+
+RNG = np.random.default_rng()
+
+# Faker's per-call provider dispatch dominates person generation, so sample once
+FAKE_POOL_SIZE = 5000
+NAME_POOL: list[str] = [FAKER.name() for _ in range(FAKE_POOL_SIZE)]
+WORD_POOL: list[str] = [FAKER.word() for _ in range(FAKE_POOL_SIZE)]
+ADDRESS_POOL: list[str] = [FAKER.address() for _ in range(FAKE_POOL_SIZE)]
+EMAIL_SEPARATORS = ["_", "."]
+EMAIL_DOMAINS = ["gmail.com", "yahoo.com", "hotmail.com", "outlook.com", "aol.com"]
+
+with open(os.path.join(os.path.dirname(__file__), "firms.json"), "r") as f:
+    FIRM_SELECTION_POOL: list[dict[str, str]] = json.load(f)
+
+
+class TokenBucketLimiter:
+    """Proactively paces requests against a requests-per-minute and a
+    tokens-per-minute budget, refilling both buckets continuously."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._available_requests = float(requests_per_minute)
+        self._available_tokens = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60
+        self._last_refill = now
+        self._available_requests = min(
+            self.requests_per_minute,
+            self._available_requests + elapsed_minutes * self.requests_per_minute,
+        )
+        self._available_tokens = min(
+            self.tokens_per_minute,
+            self._available_tokens + elapsed_minutes * self.tokens_per_minute,
+        )
 
-
-MEETINGS_CREATION_SEMAPHORE = asyncio.Semaphore(5)
-
-
-class DummyMeetingResult(BaseModel):
-    title: str
-    content: str
-
-    @classmethod
-    async def create_dummy_meeting(
-        cls,
-        firm_attended: str,
-        firms_discussed: list[str],
-        contacts: list[str],
-        employees_attending: list[str],
-        date: datetime,
-    ) -> "DummyMeetingResult":
-        interaction_type = np.random.choice(["Meeting", "Call", "Email"])
-        title = f"{interaction_type} with {firm_attended}"
-
-        additional_context = {
-            "Meeting": dedent(
-                """You are {agent_is} and you are an employee at Harvery's & Co, an investment bank. \
+    async def acquire(self, tokens: int) -> None:
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._available_requests >= 1 and self._available_tokens >= tokens:
+                    self._available_requests -= 1
+                    self._available_tokens -= tokens
+                    return
+                await asyncio.sleep(
+                    60
+                    * max(
+                        (1 - self._available_requests) / self.requests_per_minute,
+                        (tokens - self._available_tokens) / self.tokens_per_minute,
+                    )
+                )
+
+    def drain(self) -> None:
+        """Empty both buckets, e.g. after the provider reports a rate-limit hit."""
+        self._refill()
+        self._available_requests = 0.0
+        self._available_tokens = 0.0
+
+
+LLM_RATE_LIMITER = TokenBucketLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+MEETINGS_CREATION_SEMAPHORE = asyncio.Semaphore(50)
+MEETINGS_CHUNK_SIZE = 100
+
+# Shared across all meetings so connections (and their TLS sessions) are reused,
+# with HTTP/2 multiplexing concurrent requests over those connections
+HTTP_CLIENT = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+    timeout=60,
+)
+LLM = OpenAI(
+    api_key=OPENAI_API_KEY,
+    model=LLM_MODEL,
+    max_tokens=MAX_TOKENS_SYNTHETIC_SAMPLES,
+    async_http_client=HTTP_CLIENT,
+)
+
+
+def _llm_retry_wait(retry_state: RetryCallState) -> float:
+    # Rate-limit hits have already drained the limiter, which paces the retry itself
+    if isinstance(retry_state.outcome.exception(), RateLimitError):
+        return 0
+    return wait_exponential(multiplier=1, min=4, max=10)(retry_state)
+
+
+# Loop-invariant, so each interaction type is compiled once at import
+PROMPT_TEMPLATES: dict[str, PromptTemplate] = {
+    "Meeting": PromptTemplate(
+        dedent(
+            """You are {agent_is} and you are an employee at Harvery's & Co, an investment bank. \
                 Harvery's & Co specialise in investment banking, mergers and acquisitions, and asset management. \
                 Today is {date} and you are attending a meeting with {firm_attended}. \
                 Included in the discussion are your colleagues {employees_attending}, and {contacts} from {firm_attended}. \
@@ -59,9 +139,11 @@ class DummyMeetingResult(BaseModel):
 
                 Your notes should be in the form of bullet points, and each point should be a single short sentence, sometimes in \
                 shorthand. The notes should be concise and to the point, capturing the essence of the discussion."""
-            ),
-            "Call": dedent(
-                """You are {agent_is} and you are an employee at Harvery's & Co, an investment bank. \
+        )
+    ),
+    "Call": PromptTemplate(
+        dedent(
+            """You are {agent_is} and you are an employee at Harvery's & Co, an investment bank. \
                 Harvery's & Co specialise in investment banking, mergers and acquisitions, and asset management. \
                 Today is {date} and you are in a call with representatives at {firm_attended}. \
                 Included in the discussion are your colleagues {employees_attending}, and {contacts} from {firm_attended}. \
@@ -71,26 +153,43 @@ class DummyMeetingResult(BaseModel):
 
                 Your notes should be in the form of bullet points, and each point should be a single short sentence, sometimes in \
                 shorthand. The notes should be concise and to the point, capturing the essence of the discussion."""
-            ),
-            "Email": dedent(
-                """You are {agent_is} and you are an employee at Harvery's & Co, an investment bank. \
+        )
+    ),
+    "Email": PromptTemplate(
+        dedent(
+            """You are {agent_is} and you are an employee at Harvery's & Co, an investment bank. \
                 Harvery's & Co specialise in investment banking, mergers and acquisitions, and asset management. \
                 Today is {date} and you are reading an email between you and {firm_attended}. \
                 Included in the email thread are your colleagues {employees_attending}, and {contacts} from {firm_attended}. \
                 The email is discussing the following firms: {firms_discussed}. \
 
                 Write out an email thread between the parties involved, discussing the firms and any other relevant information."""
-            ),
-        }
+        )
+    ),
+}
+INTERACTION_TYPES = list(PROMPT_TEMPLATES)
 
-        agent_is = np.random.choice(employees_attending)
 
-        prompt_template = PromptTemplate(additional_context[interaction_type])
-        llm = OpenAI(
-            api_key=OPENAI_API_KEY,
-            model=LLM_MODEL,
-            max_tokens=MAX_TOKENS_SYNTHETIC_SAMPLES,
-        )
+class DummyMeetingResult(BaseModel):
+    title: str
+    content: str
+
+    @classmethod
+    async def create_dummy_meeting(
+        cls,
+        firm_attended: str,
+        firms_discussed: list[str],
+        contacts: list[str],
+        employees_attending: list[str],
+        date: datetime,
+        llm: OpenAI = LLM,
+    ) -> "DummyMeetingResult":
+        interaction_type = INTERACTION_TYPES[RNG.integers(0, len(INTERACTION_TYPES))]
+        title = f"{interaction_type} with {firm_attended}"
+
+        agent_is = employees_attending[RNG.integers(0, len(employees_attending))]
+
+        prompt_template = PROMPT_TEMPLATES[interaction_type]
 
         content = await DummyMeetingResult.call_llm(
             prompt_template.format(
@@ -107,69 +206,78 @@ class DummyMeetingResult(BaseModel):
         return cls(title=title, content=content)
 
     @staticmethod
-    @retry(
-        stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10)
-    )
-    @staticmethod
+    @retry(stop=stop_after_attempt(3), wait=_llm_retry_wait)
     async def call_llm(prompt: str, llm: OpenAI) -> str:
         async with MEETINGS_CREATION_SEMAPHORE:
-            return llm.complete(prompt).text
+            await LLM_RATE_LIMITER.acquire(
+                len(prompt) // 4 + MAX_TOKENS_SYNTHETIC_SAMPLES
+            )
+            try:
+                return (await llm.acomplete(prompt)).text
+            except RateLimitError:
+                LLM_RATE_LIMITER.drain()
+                raise
 
 
 async def create_firms(n: int):
-    with open("setup/firms.json", "r") as f:
-        firm_selection_pool: list[dict[str, str]] = json.load(f)
-
-    np.random.shuffle(firm_selection_pool)
-    if n > len(firm_selection_pool):
-        n = len(firm_selection_pool)
-
-    firm_selection_pool = firm_selection_pool[:n]
-
-    firms: list[models.Firms] = []
-    for i in range(n):
-        firm_data = firm_selection_pool[i]
-        firm = models.Firms(
-            name=firm_data["name"],
-            sector=firm_data["sector"],
-        )
-        firms.append(firm)
+    # Draw n distinct pool indices rather than shuffling the whole pool
+    selected = RNG.choice(
+        len(FIRM_SELECTION_POOL),
+        size=min(n, len(FIRM_SELECTION_POOL)),
+        replace=False,
+    )
+    firms: list[dict] = [
+        {
+            "name": FIRM_SELECTION_POOL[i]["name"],
+            "sector": FIRM_SELECTION_POOL[i]["sector"],
+        }
+        for i in selected
+    ]
 
     with session_scope() as session:
-        session.add_all(firms)
+        bulk_insert(session, models.Firms, firms)
         session.commit()
 
 
-async def create_fake_person() -> tuple[str, str, str]:
-    name = FAKER.name()
-    first_part = name.replace(" ", np.random.choice(["_", "."])).lower()
-    middle_part = (
-        f"_{FAKER.word()}"
-        if np.random.choice([True, False])
-        else str(np.random.randint(1, 100))
-        if np.random.choice([True, False])
-        else ""
-    )
-    last_part = "@" + np.random.choice(
-        ["gmail.com", "yahoo.com", "hotmail.com", "outlook.com", "aol.com"]
-    )
-    email = first_part + middle_part + last_part
-    address = FAKER.address()
-    return name, email, address
+def create_fake_people(n: int) -> list[tuple[str, str, str]]:
+    # Draw every person's pool indices and branches in single vectorized calls;
+    # one random byte per person drives the separator and middle-part branches
+    bits = RNG.integers(0, 256, n)
+    names = RNG.integers(0, FAKE_POOL_SIZE, n)
+    words = RNG.integers(0, FAKE_POOL_SIZE, n)
+    numbers = RNG.integers(1, 100, n)
+    domains = RNG.integers(0, len(EMAIL_DOMAINS), n)
+    addresses = RNG.integers(0, FAKE_POOL_SIZE, n)
+
+    people: list[tuple[str, str, str]] = []
+    for i in range(n):
+        name = NAME_POOL[names[i]]
+        first_part = name.replace(" ", EMAIL_SEPARATORS[bits[i] & 1]).lower()
+        middle_part = (
+            f"_{WORD_POOL[words[i]]}"
+            if bits[i] & 2
+            else str(numbers[i])
+            if bits[i] & 4
+            else ""
+        )
+        last_part = "@" + EMAIL_DOMAINS[domains[i]]
+        email = first_part + middle_part + last_part
+        people.append((name, email, ADDRESS_POOL[addresses[i]]))
+    return people
 
 
 async def create_contacts(n: int):
     with session_scope() as session:
         firms = session.query(models.Firms).all()
+        firm_idx = RNG.integers(0, len(firms), n)
 
         contacts: list[models.Contacts] = []
-        for i in range(n):
-            name, email, address = await create_fake_person()
+        for i, (name, email, address) in enumerate(create_fake_people(n)):
             contact = models.Contacts(
                 name=name,
                 email=email,
                 address=address,
-                firm_id=np.random.choice(firms).firm_id,
+                firm_id=firms[firm_idx[i]].firm_id,
             )
             contacts.append(contact)
 
@@ -179,8 +287,7 @@ async def create_contacts(n: int):
 
 async def create_employees(n: int):
     employees: list[models.Employees] = []
-    for i in range(n):
-        name, email, _ = await create_fake_person()
+    for name, email, _ in create_fake_people(n):
         employee = models.Employees(
             name=name,
             email=email,
@@ -193,47 +300,12 @@ async def create_employees(n: int):
 
 
 async def _create_meeting(
-    session: Session, firms: list[models.Firms], employees: list[models.Employees]
-):
-    firm_attended = np.random.choice(firms)
-    size = np.random.randint(0, min([5, len([x for x in firms if x != firm_attended])]))
-    if size > 0:
-        firms_discussed = np.random.choice(
-            [x for x in firms if x != firm_attended],
-            size=size,
-            replace=False,
-        ).tolist()
-    else:
-        firms_discussed = []
-
-    firm_contacts = (
-        session.query(models.Contacts)
-        .filter(models.Contacts.firm_id == firm_attended.firm_id)
-        .all()
-    )
-    if len(firm_contacts) > 0:
-        size = np.random.randint(0, min([3, len(firm_contacts)]))
-        if size > 0:
-            contacts = np.random.choice(
-                firm_contacts, size=size, replace=False
-            ).tolist()
-        else:
-            contacts = []
-    else:
-        contacts = []
-
-    employees_attending = np.random.choice(
-        employees,
-        size=np.random.randint(1, min([4, len(employees)])),
-        replace=False,
-    ).tolist()
-
-    date = datetime(
-        np.random.randint(2019, 2026),
-        np.random.randint(1, 13),
-        np.random.randint(1, 29),
-    )
-
+    firm_attended: models.Firms,
+    firms_discussed: list[models.Firms],
+    contacts: list[models.Contacts],
+    employees_attending: list[models.Employees],
+    date: datetime,
+) -> tuple[dict, list[dict], list[dict], list[dict]]:
     meeting_data = await DummyMeetingResult.create_dummy_meeting(
         firm_attended.name,
         [x.name for x in firms_discussed],
@@ -242,34 +314,70 @@ async def _create_meeting(
         date,
     )
 
-    meeting = models.Meetings(
-        title=meeting_data.title,
-        content=meeting_data.content,
-        date=date,
-        firm_attended=firm_attended,
-        contacts=contacts,
-        employees=employees_attending,
-        firms_discussed=firms_discussed,
+    # Assigned client-side so the link rows can reference it without RETURNING
+    meeting_id = uuid.uuid4()
+    meeting = {
+        "meeting_id": meeting_id,
+        "beam_id": uuid.uuid4(),
+        "title": meeting_data.title,
+        "content": meeting_data.content,
+        "date": date,
+        "firm_attended_id": firm_attended.firm_id,
+    }
+    return meeting, *meeting_link_rows(
+        meeting_id, firms_discussed, contacts, employees_attending
     )
-    return meeting
 
 
-async def create_meetings(n: int):
-    with session_scope() as session:
-        firms = session.query(models.Firms).all()
-        employees = session.query(models.Employees).all()
+def _insert_meetings(
+    session: Session, results: list[tuple[dict, list[dict], list[dict], list[dict]]]
+):
+    meetings: list[dict] = []
+    meeting_firms: list[dict] = []
+    meeting_contacts: list[dict] = []
+    meeting_employees: list[dict] = []
+    for meeting, firms_rows, contacts_rows, employees_rows in results:
+        meetings.append(meeting)
+        meeting_firms.extend(firms_rows)
+        meeting_contacts.extend(contacts_rows)
+        meeting_employees.extend(employees_rows)
+
+    copy_insert(session, models.Meetings, meetings)
+    copy_insert(session, models.meetings_firms_discussed_association, meeting_firms)
+    copy_insert(
+        session, models.contacts_attended_meetings_association, meeting_contacts
+    )
+    copy_insert(
+        session, models.employees_attended_meetings_association, meeting_employees
+    )
+    session.commit()
 
-        meetings: list[models.Meetings] = []
 
-        tasks = []
-        for _ in range(n):
-            tasks.append(
-                asyncio.create_task(_create_meeting(session, firms, employees))
-            )
-        meetings = await asyncio.gather(*tasks)
-
-        session.add_all(meetings)
-        session.commit()
+async def create_meetings(n: int):
+    with session_scope() as session:
+        samples = sample_meetings(session, n)
+
+        def schedule() -> list[asyncio.Task]:
+            return [
+                asyncio.create_task(_create_meeting(*sample))
+                for sample in itertools.islice(samples, MEETINGS_CHUNK_SIZE)
+            ]
+
+        # Generate in chunks, committing each chunk in a worker thread while the
+        # next chunk's LLM calls are in flight, so results never pile up in memory
+        tasks = schedule()
+        try:
+            while tasks:
+                results = await asyncio.gather(*tasks)
+                tasks = schedule()
+                await asyncio.to_thread(_insert_meetings, session, results)
+        except BaseException:
+            # Nothing awaits the in-flight chunk once a gather or insert fails, so
+            # stop its LLM calls here instead of leaving them running unobserved
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
 
 
 async def main(
@@ -278,10 +386,15 @@ async def main(
     n_employees: int,
     n_meetings: int,
 ):
-    await create_firms(n_firms)
-    await create_contacts(n_contacts)
-    await create_employees(n_employees)
-    await create_meetings(n_meetings)
+    init_db()
+    try:
+        await create_firms(n_firms)
+        await create_contacts(n_contacts)
+        await create_employees(n_employees)
+        await create_meetings(n_meetings)
+    finally:
+        # Close on the loop the client's connections were opened on
+        await HTTP_CLIENT.aclose()
 
 
 if __name__ == "__main__":
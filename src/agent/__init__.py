@@ -1,5 +1,7 @@
 from src.agent.router import SQLAgent
+from src.agent.semantic_cache import SemanticCache
 
 __all__ = [
     "SQLAgent",
+    "SemanticCache",
 ]
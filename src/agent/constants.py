@@ -1,2 +1,6 @@
 DEFAULT_TOKEN_LIMIT = 40_000
 DENORM_QUERY = "with {table_name} as (\n{subquery}\n)\n"
+RESULT_PARTITION_SIZE = 10_000
+LOGGED_RESULT_ROWS = 20
+DEFAULT_ROW_CAP = 10_000
+STATEMENT_TIMEOUT = "15s"
@@ -5,7 +5,7 @@ class ReasoningEvent(Event):
     pass
 
 
-class SQLWritingEvent(Event):
+class CombinedEvent(Event):
     pass
 
 
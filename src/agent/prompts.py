@@ -1,3 +1,6 @@
+from string import Formatter
+from typing import Callable
+
 from llama_index.core import PromptTemplate
 
 INSTRUCTIONS = (
@@ -26,8 +29,14 @@ SYSTEM = (
     f"{INSTRUCTIONS}"
 )
 
+# Each step prompt opens with the same "system" block followed by its static
+# instructions, and only then the per-request placeholders. The structured prompt
+# template puts each output model's format instructions ahead of this, so the
+# prefix shared across calls is per step: everything up to "END OF INSTRUCTIONS"
+# stays byte-identical between calls to the same step, which lets provider-side
+# prompt caching (e.g. OpenAI's automatic prefix caching) reuse the large schema.
 SQL_WRITING_PROMPT = PromptTemplate(
-    "system: {system}\n\n"
+    "system: {system}\n"
     "#### INSTRUCTIONS FOR CURRENT STEP ####\n"
     "In the previous step you thought through the user's request for data and made a plan for the type of SQL query that would be needed to retrieve the data from the database. "
     "Your task is to now write the SQL query in line with the plan you made in the previous step.\n\n"
@@ -45,7 +54,7 @@ REASONING_STEP_PROMPT = PromptTemplate(
     "#### INSTRUCTIONS FOR CURRENT STEP ####\n"
     "Given a user's request for data, analyse the request and the sort of data that the user is requesting and think through step by step "
     "the type of SQL query that would be needed to retrieve the data from the database.\n\n"
-    "Your response MUST be written in the JSON format specified below without any additional information.\n\n"
+    "Your response MUST be written in the JSON format specified at the start of this prompt without any additional information.\n\n"
     "#### END OF INSTRUCTIONS ####\n\n"
     "#### USER DATA REQUEST ####\n"
     "user: {user_query}\n\n"
@@ -65,7 +74,7 @@ VALIDATION_STEP_PROMPT = PromptTemplate(
     "```\n"
     f"{INSTRUCTIONS}"
     "```\n"
-    "Your response MUST be written in the JSON format specified below without any additional information.\n\n"
+    "Your response MUST be written in the JSON format specified at the start of this prompt without any additional information.\n\n"
     "#### END OF INSTRUCTIONS ####\n\n"
     "#### USER DATA REQUEST ####\n"
     "user: {user_query}\n\n"
@@ -76,6 +85,25 @@ VALIDATION_STEP_PROMPT = PromptTemplate(
     "Now evaluate your plan and determine whether you have followed the rules given to you. "
 )
 
+COMBINED_STEP_PROMPT = PromptTemplate(
+    "system: {system}\n"
+    "#### INSTRUCTIONS FOR CURRENT STEP ####\n"
+    "Given a user's request for data, complete the following in a single response:\n"
+    "\t1. Analyse the request and the sort of data that the user is requesting and think through step by step "
+    "the type of SQL query that would be needed to retrieve the data from the database.\n"
+    "\t2. Evaluate your plan and validate whether it follows the rules given to you. "
+    "Here are the rules you were instructed to follow:\n"
+    "```\n"
+    f"{INSTRUCTIONS}"
+    "```\n"
+    "\t3. Write the SQL query in line with your plan.\n\n"
+    "Your response MUST be written in the JSON format specified at the start of this prompt without any additional information.\n\n"
+    "#### END OF INSTRUCTIONS ####\n\n"
+    "#### USER DATA REQUEST ####\n"
+    "user: {user_query}\n\n"
+    "#### END OF USER DATA REQUEST ####\n\n"
+)
+
 FAILURE_OUTPUT = (
     "The SQL Agent has determined that the query is not possible to execute. "
     "Here were the thoughts and conclusions of the Agent:\n\n"
@@ -84,6 +112,11 @@ FAILURE_OUTPUT = (
     "```\n"
 )
 
+TRUNCATED_OUTPUT = (
+    "The data returned from the SQL query is valid, but it was truncated to the "
+    "first {row_cap} rows. Narrow the request to see the remaining data."
+)
+
 TOOL_ERROR = PromptTemplate(
     "The SQL query did not complete successfully. The error message is as follows:\n\n"
     "```\n"
@@ -91,3 +124,28 @@ TOOL_ERROR = PromptTemplate(
     "```\n"
     "Reverting back to the planning stage to try again."
 )
+
+
+def _compile_template(template: PromptTemplate) -> Callable[..., str]:
+    # Split the template into literal segments and placeholder names once, so each
+    # workflow round only has to join the pieces with the dynamic values
+    segments = [
+        (literal, field)
+        for literal, field, _, _ in Formatter().parse(template.template)
+    ]
+
+    def format_prompt(**kwargs: str) -> str:
+        parts: list[str] = []
+        for literal, field in segments:
+            parts.append(literal)
+            if field is not None:
+                parts.append(str(kwargs[field]))
+        return "".join(parts)
+
+    return format_prompt
+
+
+SQL_WRITING_PROMPT_FMT = _compile_template(SQL_WRITING_PROMPT)
+REASONING_STEP_PROMPT_FMT = _compile_template(REASONING_STEP_PROMPT)
+VALIDATION_STEP_PROMPT_FMT = _compile_template(VALIDATION_STEP_PROMPT)
+COMBINED_STEP_PROMPT_FMT = _compile_template(COMBINED_STEP_PROMPT)
@@ -1,10 +1,27 @@
-from typing import Optional
+import re
+from typing import Any, Optional
 
 import pandas as pd
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from src.agent.constants import DEFAULT_ROW_CAP
+
+# Statement separators and comments have no place in a single clause
+UNSAFE_CLAUSE_PATTERN = re.compile(r";|--|/\*")
+ORDER_BY_DIRECTION_PATTERN = re.compile(
+    r"(?:asc|desc)(?:\s+nulls\s+(?:first|last))?", re.IGNORECASE
+)
+
+
+class ClauseRejectedError(Exception):
+    # Deliberately not a ValueError: pydantic raises it unwrapped and the invocation
+    # retries don't catch it, so a rejected clause goes straight back to reasoning
+    pass
 
 
 class Thought(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     thought: str = Field(
         description="A thought around the task you are performing."
     )
@@ -17,6 +34,8 @@ class Thought(BaseModel):
 
 
 class ReasoningOutput(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     thoughts: list[Thought] = Field(
         description="List of thoughts and conclusions that you have made in the reasoning process."
     )
@@ -27,8 +46,14 @@ class ReasoningOutput(BaseModel):
     def get_thoughts(self) -> str:
         return "\n".join([str(t) for t in self.thoughts])
 
+    def get_conclusions(self) -> str:
+        # Compact form kept in the agent's memory instead of the full thoughts
+        return "\n".join([t.conclusion for t in self.thoughts])
+
 
 class SQLQuery(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     where_clauses: list[str] = Field(
         description=(
             "List of where clauses that will be inserted into the SQL query. "
@@ -60,20 +85,58 @@ class SQLQuery(BaseModel):
         default=None,
     )
 
+    @field_validator("where_clauses", "order_by_fields")
+    @classmethod
+    def reject_unsafe_clauses(cls, clauses: list[str]) -> list[str]:
+        for clause in clauses:
+            if UNSAFE_CLAUSE_PATTERN.search(clause):
+                raise ClauseRejectedError(
+                    f"Clause contains a statement separator or comment: {clause!r}"
+                )
+        return clauses
+
+    @field_validator("order_by_direction", mode="before")
+    @classmethod
+    def strip_order_by_direction(cls, direction: Any) -> Any:
+        # A blank direction means no direction, and the stripped value is what renders
+        if isinstance(direction, str):
+            return direction.strip() or None
+        return direction
+
+    @field_validator("order_by_direction")
+    @classmethod
+    def check_order_by_direction(cls, direction: Optional[str]) -> Optional[str]:
+        # Rendered verbatim after ORDER BY, so only a bare direction is accepted
+        if direction is not None and not ORDER_BY_DIRECTION_PATTERN.fullmatch(
+            direction
+        ):
+            raise ClauseRejectedError(f"Invalid order by direction: {direction!r}")
+        return direction
+
     def to_sql_statement(self, table_name: str) -> str:
-        statement = "SELECT * FROM " + table_name
+        parts = [f"SELECT * FROM {table_name}"]
         if self.where_clauses:
-            statement += "\nWHERE " + " AND ".join(self.where_clauses)
+            parts.append("WHERE " + " AND ".join(self.where_clauses))
         if self.order_by_fields:
-            statement += "\nORDER BY " + ", ".join(self.order_by_fields)
+            order_by = "ORDER BY " + ", ".join(self.order_by_fields)
             if self.order_by_direction:
-                statement += f" {self.order_by_direction}"
-        if self.limit:
-            statement += f"\nLIMIT {self.limit}"
-        return statement
+                order_by += f" {self.order_by_direction}"
+            parts.append(order_by)
+        # int() so only a plain number can ever reach the LIMIT clause, and the cap
+        # applies even when the model asks for no limit at all. Capped queries fetch
+        # one row past the cap, so a result that only just fits isn't reported as
+        # truncated
+        if self.limit is None or self.limit > DEFAULT_ROW_CAP:
+            limit = DEFAULT_ROW_CAP + 1
+        else:
+            limit = max(int(self.limit), 1)
+        parts.append(f"LIMIT {limit}")
+        return "\n".join(parts)
     
     
 class ValidationOutput(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     thoughts: list[Thought] = Field(
         description="List of thoughts and conclusions around how your plan does / does not follow the instructions, concluding whether the instructions are being followed."
     )
@@ -84,10 +147,26 @@ class ValidationOutput(BaseModel):
     def get_thoughts(self) -> str:
         return "\n".join([str(t) for t in self.thoughts])
 
+    def get_conclusions(self) -> str:
+        return "\n".join([t.conclusion for t in self.thoughts])
+
+
+class CombinedAgentOutput(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    reasoning: ReasoningOutput = Field(
+        description="Your reasoning about the user's request and the SQL query needed to retrieve the data."
+    )
+    validation: ValidationOutput = Field(
+        description="Your evaluation of whether your reasoning follows the instructions."
+    )
+    sql_query: SQLQuery = Field(
+        description="The SQL query written in line with your reasoning."
+    )
+
 
 class SQLAgentOutput(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     text: str
     results_df: Optional[pd.DataFrame] = None
-
-    class Config:
-        arbitrary_types_allowed = True
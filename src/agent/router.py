@@ -1,6 +1,10 @@
+import asyncio
+import contextlib
+import hashlib
 import logging
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 import pandas as pd
 from llama_index.core.base.llms.types import MessageRole
@@ -8,71 +12,229 @@ from llama_index.core.llms import ChatMessage
 from llama_index.core.llms.llm import LLM
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.workflow import Context, StartEvent, StopEvent, Workflow, step
-from sqlalchemy import text
-from sqlalchemy.orm import Session
-
-from src.agent.constants import DEFAULT_TOKEN_LIMIT, DENORM_QUERY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.agent.constants import (
+    DEFAULT_ROW_CAP,
+    DEFAULT_TOKEN_LIMIT,
+    DENORM_QUERY,
+    LOGGED_RESULT_ROWS,
+    RESULT_PARTITION_SIZE,
+    STATEMENT_TIMEOUT,
+)
 from src.agent.events import (
+    CombinedEvent,
     DataReturnEvent,
     FailureEvent,
     ReasoningEvent,
     SQLExecutionEvent,
     SQLValidationEvent,
-    SQLWritingEvent,
 )
 from src.agent.prompts import (
+    COMBINED_STEP_PROMPT_FMT,
     FAILURE_OUTPUT,
-    REASONING_STEP_PROMPT,
-    SQL_WRITING_PROMPT,
+    REASONING_STEP_PROMPT_FMT,
+    SQL_WRITING_PROMPT_FMT,
     SYSTEM,
     TOOL_ERROR,
-    VALIDATION_STEP_PROMPT,
+    TRUNCATED_OUTPUT,
+    VALIDATION_STEP_PROMPT_FMT,
 )
 from src.agent.pydantics import (
+    ClauseRejectedError,
+    CombinedAgentOutput,
     ReasoningOutput,
     SQLAgentOutput,
     SQLQuery,
     ValidationOutput,
 )
+from src.agent.semantic_cache import SemanticCache
 from src.invocations import invocation_validator
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=8)
+def _read_file(path: Path) -> str:
+    return path.read_text()
+
+
+@lru_cache(maxsize=8)
+def _build_system_prompt(system_prompt: str, table_name: str, schema_path: Path) -> str:
+    return system_prompt.format(
+        table_name=table_name,
+        schema=_read_file(schema_path),
+    )
+
+
+@lru_cache(maxsize=8)
+def _prompt_version(system_prompt: str, query_prefix: str) -> str:
+    return hashlib.blake2b(
+        f"{system_prompt}\0{query_prefix}".encode(), digest_size=16
+    ).hexdigest()
+
+
+async def _discard(task: asyncio.Task) -> None:
+    # Awaited after cancelling so the task is cleaned up and anything it had already
+    # raised is retrieved rather than reported as never retrieved
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await task
+
+
+def _markdown_cell(value: Any) -> str:
+    return str(value).replace("|", "\\|").replace("\n", " ")
+
+
+def _df_to_markdown(df: pd.DataFrame) -> str:
+    # A plain join over the rows, without tabulate's per-cell alignment passes
+    header = "| | " + " | ".join(map(_markdown_cell, df.columns)) + " |"
+    separator = "|---" * (len(df.columns) + 1) + "|"
+    rows = (
+        "| " + " | ".join(map(_markdown_cell, row)) + " |"
+        for row in df.itertuples(index=True, name=None)
+    )
+    return "\n".join([header, separator, *rows])
+
+
 class SQLAgent(Workflow):
     _llm_kwargs: dict[str, Any] = {"max_tokens": 500}
+    _combined_llm_kwargs: dict[str, Any] = {"max_tokens": 1500}
     _max_rounds: int = 3
 
     def __init__(
         self,
         llm: LLM,
-        session: Session,
+        session: AsyncSession,
         table_name: str = "meeting_notes",
         schema_path: Path = Path("src/schemas/meetings_denorm_schema.txt"),
         denormalized_query_path: Path = Path("src/schemas/meetings_denorm.sql"),
         system_prompt: str = SYSTEM,
+        semantic_cache: Optional[SemanticCache] = None,
+        combined_first: bool = False,
     ):
         super().__init__(timeout=None)
         self.llm = llm
         self.session = session
         self.table_name = table_name
-        self.denormalized_query: str = denormalized_query_path.read_text()
-        self.system_prompt = system_prompt.format(
-            table_name=table_name,
-            schema=schema_path.read_text(),
+        # Shared across agent instances by the caller, so near-duplicate questions
+        # can skip the reasoning loop and the database entirely
+        self.semantic_cache = semantic_cache
+        # Try reasoning, validation and writing in one LLM call before falling back
+        # to the step-by-step loop
+        self.combined_first = combined_first
+        # Memoized so per-request agents don't re-read and re-format the schema files
+        self.denormalized_query: str = _read_file(denormalized_query_path)
+        self.system_prompt = _build_system_prompt(
+            system_prompt, table_name, schema_path
         )
+        # Invariant for the agent's lifetime, so only the LLM tail varies per query
+        self._query_prefix = DENORM_QUERY.format(
+            table_name=table_name, subquery=self.denormalized_query
+        )
+        # Semantic cache entries are namespaced by the prompt and schema they were
+        # answered under, so editing either file invalidates them
+        self.cache_namespace = (
+            f"{table_name}:{_prompt_version(self.system_prompt, self._query_prefix)}"
+        )
+
+    async def _remember(
+        self, ctx: Context, memory: ChatMemoryBuffer, message: ChatMessage
+    ) -> None:
+        # The rendered history is extended as messages arrive, rather than every
+        # round re-serializing and re-joining everything in memory
+        memory.put(message)
+        history = await ctx.get("history")
+        await ctx.set("memory", memory)
+        await ctx.set("history", f"{history}\n{message}" if history else str(message))
 
     @step
-    async def start_step(self, ctx: Context, ev: StartEvent) -> ReasoningEvent:
+    async def start_step(
+        self, ctx: Context, ev: StartEvent
+    ) -> ReasoningEvent | CombinedEvent | StopEvent:
         logger.info(f"[{type(self.__class__)}]: start_step.")
         user_query = str(ev.input)
+
+        query_embedding = None
+        if self.semantic_cache:
+            # Literal repeats skip the embedding call as well
+            cached = self.semantic_cache.lookup_exact(self.cache_namespace, user_query)
+            if not cached:
+                query_embedding = await self.semantic_cache.embed(user_query)
+                cached = self.semantic_cache.lookup(
+                    self.cache_namespace, query_embedding
+                )
+            if cached:
+                logger.info(f"[{type(self.__class__)}]: semantic cache hit.")
+                return StopEvent(result=cached)
+        await ctx.set("query_embedding", query_embedding)
+
         memory = ChatMemoryBuffer(token_limit=DEFAULT_TOKEN_LIMIT)
         await ctx.set("user_query", user_query)
         await ctx.set("memory", memory)
+        await ctx.set("history", "")
         await ctx.set("result_df", None)
         await ctx.set("rounds", 0)
+        if self.combined_first:
+            return CombinedEvent()
         return ReasoningEvent()
 
+    @step
+    async def combined_step(
+        self, ctx: Context, ev: CombinedEvent
+    ) -> SQLExecutionEvent | ReasoningEvent:
+        logger.info(f"[{type(self.__class__)}]: combined_step.")
+
+        user_query = await ctx.get("user_query")
+        memory: ChatMemoryBuffer = await ctx.get("memory")
+
+        prompt = COMBINED_STEP_PROMPT_FMT(
+            system=self.system_prompt,
+            table_name=self.table_name,
+            user_query=user_query,
+        )
+
+        try:
+            response: CombinedAgentOutput = (
+                await invocation_validator.structured_invocation(
+                    llm=self.llm,
+                    context=prompt,
+                    pydantic_object=CombinedAgentOutput,
+                    llm_kwargs=self._combined_llm_kwargs,
+                )
+            )
+        except Exception as e:
+            logger.info(f"[{type(self.__class__)}]: combined_step failed: {e}.")
+            return ReasoningEvent()
+
+        logger.info(f"[{type(self.__class__)}]: {response}.")
+
+        # Anything short of a possible, validated plan goes through the full loop
+        if not (response.reasoning.possible and response.validation.valid):
+            return ReasoningEvent()
+
+        await self._remember(
+            ctx,
+            memory,
+            ChatMessage(
+                role=MessageRole.ASSISTANT,
+                content=response.reasoning.get_conclusions(),
+            ),
+        )
+        await self._remember(
+            ctx,
+            memory,
+            ChatMessage(
+                role=MessageRole.ASSISTANT,
+                content=str(response.sql_query),
+            ),
+        )
+
+        query = response.sql_query.to_sql_statement(self.table_name)
+        logger.info(f"[{type(self.__class__)}]: {query}.")
+
+        return SQLExecutionEvent(query=query)
+
     @step
     async def reasoning_step(
         self, ctx: Context, ev: ReasoningEvent
@@ -90,12 +252,11 @@ class SQLAgent(Workflow):
 
         user_query = await ctx.get("user_query")
         memory: ChatMemoryBuffer = await ctx.get("memory")
-        messages = memory.get_all()
 
-        prompt = REASONING_STEP_PROMPT.format(
+        prompt = REASONING_STEP_PROMPT_FMT(
             system=self.system_prompt,
             user_query=user_query,
-            history="\n".join([str(m) for m in messages]),
+            history=await ctx.get("history"),
         )
 
         response: ReasoningOutput = await invocation_validator.structured_invocation(
@@ -106,13 +267,14 @@ class SQLAgent(Workflow):
         )
 
         thoughts = response.get_thoughts()
-        memory.put(
+        await self._remember(
+            ctx,
+            memory,
             ChatMessage(
                 role=MessageRole.ASSISTANT,
-                content=thoughts,
-            )
+                content=response.get_conclusions(),
+            ),
         )
-        await ctx.set("memory", memory)
 
         logger.info(f"[{type(self.__class__)}]: {response}.")
 
@@ -120,61 +282,90 @@ class SQLAgent(Workflow):
             return FailureEvent(thoughts=thoughts)
 
         return SQLValidationEvent(thoughts=thoughts)
-    
+
     @step
-    async def sql_validation_step(self, ctx: Context, ev: SQLValidationEvent) -> SQLWritingEvent | ReasoningEvent:
+    async def sql_validation_step(
+        self, ctx: Context, ev: SQLValidationEvent
+    ) -> SQLExecutionEvent | ReasoningEvent:
         logger.info(f"[{type(self.__class__)}]: sql_validation_step.")
         thoughts = ev.thoughts
         user_query = await ctx.get("user_query")
-        
-        prompt = VALIDATION_STEP_PROMPT.format(
+        memory: ChatMemoryBuffer = await ctx.get("memory")
+
+        # Writing only depends on the plan already in memory, so start it speculatively
+        # alongside validation and discard it if the plan is rejected
+        writing_task = asyncio.create_task(
+            self._write_sql(user_query, await ctx.get("history"))
+        )
+
+        prompt = VALIDATION_STEP_PROMPT_FMT(
             system=self.system_prompt,
             plan=thoughts,
             table_name=self.table_name,
             user_query=user_query,
         )
 
-        response: ValidationOutput = await invocation_validator.structured_invocation(
-            llm=self.llm,
-            context=prompt,
-            pydantic_object=ValidationOutput,
-            llm_kwargs=self._llm_kwargs,
-        )
-        
+        try:
+            response: ValidationOutput = (
+                await invocation_validator.structured_invocation(
+                    llm=self.llm,
+                    context=prompt,
+                    pydantic_object=ValidationOutput,
+                    llm_kwargs=self._llm_kwargs,
+                )
+            )
+        except BaseException:
+            await _discard(writing_task)
+            raise
+
         if not response.valid:
-            memory: ChatMemoryBuffer = await ctx.get("memory")
-            memory.put(
+            await _discard(writing_task)
+            await self._remember(
+                ctx,
+                memory,
                 ChatMessage(
                     role=MessageRole.ASSISTANT,
-                    content=response.get_thoughts(),
-                )
+                    content=response.get_conclusions(),
+                ),
             )
-            await ctx.set("memory", memory)
             return ReasoningEvent()
-        
-        return SQLWritingEvent()
 
-    @step
-    async def failure_exit_step(self, ev: FailureEvent) -> StopEvent:
-        logger.info(f"[{type(self.__class__)}]: failure_exit_step.")
-        thoughts = ev.thoughts
-        output = FAILURE_OUTPUT.format(thoughts=thoughts)
-        return StopEvent(result=SQLAgentOutput(text=output))
+        try:
+            sql_query = await writing_task
+        except ClauseRejectedError as e:
+            # The generated clauses failed local validation, so go back to planning
+            # with the reason instead of sending them to the database
+            await self._remember(
+                ctx,
+                memory,
+                ChatMessage(
+                    role=MessageRole.TOOL,
+                    content=TOOL_ERROR.format(error=str(e)),
+                    additional_kwargs={"tool_call_id": self.table_name},
+                ),
+            )
+            return ReasoningEvent()
+        await self._remember(
+            ctx,
+            memory,
+            ChatMessage(
+                role=MessageRole.ASSISTANT,
+                content=str(sql_query),
+            ),
+        )
 
-    @step
-    async def sql_writing_step(
-        self, ctx: Context, ev: SQLWritingEvent
-    ) -> SQLExecutionEvent:
-        logger.info(f"[{type(self.__class__)}]: sql_writing_step.")
+        query = sql_query.to_sql_statement(self.table_name)
+        logger.info(f"[{type(self.__class__)}]: {query}.")
 
-        user_query = await ctx.get("user_query")
-        memory: ChatMemoryBuffer = await ctx.get("memory")
-        messages = memory.get_all()
+        return SQLExecutionEvent(query=query)
+
+    async def _write_sql(self, user_query: str, history: str) -> SQLQuery:
+        logger.info(f"[{type(self.__class__)}]: sql_writing_step.")
 
-        prompt = SQL_WRITING_PROMPT.format(
+        prompt = SQL_WRITING_PROMPT_FMT(
             system=self.system_prompt,
             user_query=user_query,
-            history="\n".join([str(m) for m in messages]),
+            history=history,
         )
 
         response: SQLQuery = await invocation_validator.structured_invocation(
@@ -183,20 +374,14 @@ class SQLAgent(Workflow):
             pydantic_object=SQLQuery,
             llm_kwargs=self._llm_kwargs,
         )
+        return response
 
-        memory.put(
-            ChatMessage(
-                role=MessageRole.ASSISTANT,
-                content=str(response),
-            )
-        )
-        await ctx.set("memory", memory)
-
-        logger.info(
-            f"[{type(self.__class__)}]: {response.to_sql_statement(self.table_name)}."
-        )
-
-        return SQLExecutionEvent(query=response.to_sql_statement(self.table_name))
+    @step
+    async def failure_exit_step(self, ev: FailureEvent) -> StopEvent:
+        logger.info(f"[{type(self.__class__)}]: failure_exit_step.")
+        thoughts = ev.thoughts
+        output = FAILURE_OUTPUT.format(thoughts=thoughts)
+        return StopEvent(result=SQLAgentOutput(text=output))
 
     @step
     async def sql_execution_step(
@@ -208,39 +393,83 @@ class SQLAgent(Workflow):
         memory: ChatMemoryBuffer = await ctx.get("memory")
 
         try:
-            processed_query = (
-                DENORM_QUERY.format(
-                    table_name=self.table_name, subquery=self.denormalized_query
-                )
-                + query
-            )
-            result = self.session.execute(text(processed_query)).fetchall()
-            result_df = pd.DataFrame(result)
+            processed_query = self._query_prefix + query
+            result_df = await self._fetch_dataframe(processed_query)
 
         except Exception as e:
             error_str = str(e)
-            memory.put(
+            await self._remember(
+                ctx,
+                memory,
                 ChatMessage(
                     role=MessageRole.TOOL,
                     content=TOOL_ERROR.format(error=error_str),
                     additional_kwargs={"tool_call_id": self.table_name},
-                )
+                ),
             )
-            await ctx.set("memory", memory)
             return ReasoningEvent()
 
         await ctx.set("result_df", result_df)
 
         return DataReturnEvent()
 
+    async def _fetch_dataframe(self, query: str) -> pd.DataFrame:
+        # Read straight from the asyncpg connection under the session, so records
+        # decoded by asyncpg's binary protocol are transposed into columns without
+        # building a SQLAlchemy Row for each one. prepare() bypasses asyncpg's
+        # statement cache, which suits generated SQL that is new text almost every
+        # round: a per-connection plan cache would only fill with one-off entries.
+        connection = await self.session.connection()
+        driver_connection = (await connection.get_raw_connection()).driver_connection
+        # The transaction also rolls back a failed query, leaving the session usable
+        # for the next round. Read only, so Postgres itself rejects any statement that
+        # would modify data, wherever in the generated SQL it hides
+        async with driver_connection.transaction(readonly=True):
+            # Scoped to this transaction, so a runaway query can't hold the worker
+            await driver_connection.execute(
+                f"SET LOCAL statement_timeout = '{STATEMENT_TIMEOUT}'"
+            )
+            statement = await driver_connection.prepare(query)
+            columns: dict[str, list[Any]] = {
+                attribute.name: [] for attribute in statement.get_attributes()
+            }
+            # Server-side cursor, so only one partition of records is alive at a time
+            cursor = await statement.cursor()
+            while partition := await cursor.fetch(RESULT_PARTITION_SIZE):
+                for values, column in zip(zip(*partition), columns.values()):
+                    column.extend(values)
+        return pd.DataFrame(columns)
+
     @step
     async def data_exit_step(self, ctx: Context, ev: DataReturnEvent) -> StopEvent:
         logger.info(f"[{type(self.__class__)}]: data_exit_step.")
         data: pd.DataFrame = await ctx.get("result_df")
-        logger.info(str(data.to_markdown()))
-        return StopEvent(
-            result=SQLAgentOutput(
-                text="The data returned from the SQL query is valid.",
-                results_df=data,
+        # Only a query capped by to_sql_statement can return the row past the cap
+        truncated = len(data) > DEFAULT_ROW_CAP
+        if truncated:
+            data = data.iloc[:DEFAULT_ROW_CAP]
+        records_found = len(data)
+        # Rendering the full frame to markdown can be a multi-MB string, so only a
+        # preview (a view, never a copy) is rendered and only when INFO is emitted
+        if logger.isEnabledFor(logging.INFO):
+            preview = (
+                data.head(LOGGED_RESULT_ROWS)
+                if records_found > LOGGED_RESULT_ROWS
+                else data
             )
-        )
+            logger.info(
+                f"[{type(self.__class__)}]: {records_found} rows.\n"
+                f"{_df_to_markdown(preview)}"
+            )
+        if truncated:
+            text = TRUNCATED_OUTPUT.format(row_cap=DEFAULT_ROW_CAP)
+        else:
+            text = "The data returned from the SQL query is valid."
+        output = SQLAgentOutput(text=text, results_df=data)
+        if self.semantic_cache:
+            user_query = await ctx.get("user_query")
+            query_embedding = await ctx.get("query_embedding")
+            self.semantic_cache.insert(
+                self.cache_namespace, user_query, query_embedding, output
+            )
+        return StopEvent(result=output)
@@ -0,0 +1,113 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+
+from src.agent.pydantics import SQLAgentOutput
+
+
+def _normalize(user_query: str) -> str:
+    return " ".join(user_query.lower().split())
+
+
+def _copy_output(output: SQLAgentOutput) -> SQLAgentOutput:
+    # Callers get their own DataFrame, so editing one can't change a cached entry
+    if output.results_df is None:
+        return output
+    return output.model_copy(update={"results_df": output.results_df.copy()})
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        threshold: float = 0.93,
+        max_entries: int = 10_000,
+        ttl: float = 7 * 24 * 60 * 60,
+    ):
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (namespace, normalized query, embedding, output, inserted at)
+        self._entries: OrderedDict[
+            int, tuple[str, str, np.ndarray, SQLAgentOutput, float]
+        ] = OrderedDict()
+        self._next_key = 0
+        # Literal repeats are answered from here without calling the embedding model
+        self._exact: dict[tuple[str, str], int] = {}
+        # Stacked (keys, matrix) per namespace, rebuilt lazily after inserts/evictions
+        self._matrices: dict[str, tuple[list[int], np.ndarray]] = {}
+
+    async def embed(self, user_query: str) -> np.ndarray:
+        embedding = np.asarray(
+            await self.embed_model.aget_query_embedding(user_query), dtype=np.float32
+        )
+        return embedding / np.linalg.norm(embedding)
+
+    def lookup_exact(self, namespace: str, user_query: str) -> Optional[SQLAgentOutput]:
+        key = self._exact.get((namespace, _normalize(user_query)))
+        if key is None:
+            return None
+        return self._hit(key)
+
+    def lookup(self, namespace: str, embedding: np.ndarray) -> Optional[SQLAgentOutput]:
+        if namespace not in self._matrices:
+            entries = [
+                (key, entry[2])
+                for key, entry in self._entries.items()
+                if entry[0] == namespace
+            ]
+            if not entries:
+                return None
+            keys, embeddings = zip(*entries)
+            self._matrices[namespace] = (list(keys), np.vstack(embeddings))
+
+        keys, matrix = self._matrices[namespace]
+        # Embeddings are unit-normalized, so the dot product is the cosine similarity
+        similarities = matrix @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return self._hit(keys[best])
+
+    def insert(
+        self,
+        namespace: str,
+        user_query: str,
+        embedding: np.ndarray,
+        output: SQLAgentOutput,
+    ) -> None:
+        normalized = _normalize(user_query)
+        replaced = self._exact.get((namespace, normalized))
+        if replaced is not None:
+            self._evict(replaced)
+
+        self._entries[self._next_key] = (
+            namespace,
+            normalized,
+            embedding,
+            _copy_output(output),
+            time.monotonic(),
+        )
+        self._exact[(namespace, normalized)] = self._next_key
+        self._next_key += 1
+        self._matrices.pop(namespace, None)
+
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+
+    def _hit(self, key: int) -> Optional[SQLAgentOutput]:
+        *_, output, inserted_at = self._entries[key]
+        if time.monotonic() - inserted_at > self.ttl:
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return _copy_output(output)
+
+    def _evict(self, key: int) -> None:
+        namespace, normalized, *_ = self._entries.pop(key)
+        del self._exact[(namespace, normalized)]
+        self._matrices.pop(namespace, None)
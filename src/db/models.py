@@ -1,12 +1,11 @@
 from __future__ import annotations
 
 import uuid
-from textwrap import dedent
 
 from sqlalchemy import TIMESTAMP, UUID, Column, ForeignKey, String, Table, text
 from sqlalchemy.orm import relationship
 
-from src.db.database import Base, engine
+from src.db.database import Base
 
 contacts_attended_meetings_association = Table(
     "contact_meetings",
@@ -32,35 +31,6 @@ employees_attended_meetings_association = Table(
 
 class Meetings(Base):
     __tablename__ = "meetings"
-    __context_str__ = dedent(
-        """
-        Table Name: meetings
-        Description: A table that stores meeting notes for various meetings that have taken place.
-        Columns:
-            - meeting_id: UUID, primary_key:
-                - Unique identifier for the meeting, this should never be presented to the user.
-            - beam_id: UUID
-                - Unique identifier for the meeting, this must be presented to the user wherever possible.
-            - title: String, not null
-                - The title of the meeting.
-            - content: String, not null
-                - The meeting notes recorded for the meeting.
-            - date: TIMESTAMP
-                - The date and time the meeting took place.
-            - created_at: TIMESTAMP
-                - The date and time the row was created in the database.
-            - firm_attended_id: UUID, ForeignKey('firms.firm_id')
-                - The id of the firm that attended the meeting.
-            - firm_attended: relationship('Firms', foreign_keys=[firm_attended_id], back_populates='meetings_attended')
-                - The firm that attended the meeting.
-            - contacts: relationship('Contacts', secondary=contacts_attended_meetings_association, back_populates='meetings_attended')
-                - The external contacts from Firms that attended the meeting.
-            - employees: relationship('Employees', secondary=employees_attended_meetings_association, back_populates='meetings_attended')
-                - The internal employees that attended the meeting.
-            - firms_discussed: relationship('Firms', secondary=meetings_firms_discussed_association, back_populates='meetings_discussed')
-                - The firms that were discussed during the meeting.
-        """
-    )
 
     meeting_id = Column(
         UUID(as_uuid=True),
@@ -113,27 +83,6 @@ class Meetings(Base):
 
 class Firms(Base):
     __tablename__ = "firms"
-    __context_str__ = dedent(
-        """
-        Table Name: firms
-        Description: A table that stores information on Firms that the company is/has interacted with or discussed in meetings.
-        Columns:
-            - firm_id: UUID, primary_key:
-                - Unique identifier for the firm, this should never be presented to the user.
-            - name: String, not null
-                - The name of the firm.
-            - sector: String
-                - The sector the firm operates in.
-            - created_at: TIMESTAMP
-                - The date and time the row was created in the database.
-            - contacts: relationship('Contacts', back_populates='firm')
-                - The contacts that work for the firm.
-            - meetings_attended: relationship('Meetings', foreign_keys='Meetings.firm_attended_id', back_populates='firm_attended')
-                - The meetings that the firm attended.
-            - meetings_discussed: relationship('Meetings', secondary=meetings_firms_discussed_association, back_populates='firms_discussed')
-                - The meetings where the firm was discussed.
-        """
-    )
 
     firm_id = Column(
         UUID(as_uuid=True),
@@ -164,29 +113,6 @@ class Firms(Base):
 
 class Contacts(Base):
     __tablename__ = "contacts"
-    __context_str__ = dedent(
-        """
-        Table Name: contacts
-        Description: A table that stores information on external contacts that work at firms the company is/has interacted with or discussed.
-        Columns:
-            - contact_id: UUID, primary_key:
-                - Unique identifier for the contact, this should never be presented to the user.
-            - name: String, not null
-                - The name of the contact.
-            - email: String
-                - The email address of the contact.
-            - address: String
-                - The address of the contact.
-            - created_at: TIMESTAMP
-                - The date and time the row was created in the database.
-            - firm_id: UUID, ForeignKey('firms.firm_id')
-                - The id of the firm the contact works for.
-            - firm: relationship('Firms', back_populates='contacts')
-                - The firm the contact works for.
-            - meetings_attended: relationship('Meetings', secondary=contacts_attended_meetings_association, back_populates='contacts_attended')
-                - The meetings the contact attended.
-        """
-    )
 
     contact_id = Column(
         UUID(as_uuid=True),
@@ -203,7 +129,11 @@ class Contacts(Base):
         comment="The date and time the row was created in the database.",
     )
 
-    firm_id = Column(UUID(as_uuid=True), ForeignKey("firms.firm_id"))
+    firm_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("firms.firm_id"),
+        comment="The id of the firm the contact works for.",
+    )
     firm = relationship("Firms", back_populates="contacts")
     meetings_attended = relationship(
         "Meetings",
@@ -214,23 +144,6 @@ class Contacts(Base):
 
 class Employees(Base):
     __tablename__ = "employees"
-    __context_str__ = dedent(
-        """
-        Table Name: employees
-        Description: A table that stores information on internal employees for our company.
-        Columns:
-            - employee_id: UUID, primary_key:
-                - Unique identifier for the employee, this should never be presented to the user.
-            - name: String, not null
-                - The name of the employee.
-            - email: String
-                - The email address of the employee.
-            - created_at: TIMESTAMP
-                - The date and time the row was created in the database.
-            - meetings_attended: relationship('Meetings', secondary=employees_attended_meetings_association, back_populates='employees')
-                - The meetings the employee attended.
-        """
-    )
 
     employee_id = Column(
         UUID(as_uuid=True),
@@ -251,6 +164,3 @@ class Employees(Base):
         secondary=employees_attended_meetings_association,
         back_populates="employees",
     )
-
-
-Base.metadata.create_all(bind=engine)
@@ -2,14 +2,18 @@ from src.invocations.invocations import (
     MultiInvocationWithValidation,
     invocation_validator,
     non_structured_invocation,
+    non_structured_invocation_async,
     non_structured_streamed_invocation,
     structured_invocation,
+    structured_invocation_async,
 )
 
 __all__ = [
     "invocation_validator",
     "structured_invocation",
+    "structured_invocation_async",
     "non_structured_invocation",
+    "non_structured_invocation_async",
     "non_structured_streamed_invocation",
     "MultiInvocationWithValidation",
 ]
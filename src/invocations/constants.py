@@ -1,12 +1,28 @@
+import re
+
 STOP_AFTER_ATTEMPT: int = 5
 
-WAIT_FIXED: int = 1
+WAIT_EXPONENTIAL_MULTIPLIER: float = 0.5
+
+WAIT_EXPONENTIAL_MAX: int = 8
+
+# Matches a whole JSON string first, so Python-cased literals are only repaired
+# where they stand as bare values and never inside what the model wrote
+JSON_LITERAL_PATTERN: re.Pattern = re.compile(
+    r'"(?:\\.|[^"\\])*"|\b(True|False|None)\b'
+)
+
+JSON_LITERAL_REPLACEMENTS: dict[str, str] = {
+    "True": "true",
+    "False": "false",
+    "None": "null",
+}
 
-REPLACEMENT_PATTERNS: list[tuple[str, str]] = [
-    (r":\s*true", ": True"),
-    (r":\s*false", ": False"),
+REPLACEMENT_PATTERNS: list[tuple[re.Pattern, str]] = [
+    (re.compile(r":\s*true", re.IGNORECASE), ": True"),
+    (re.compile(r":\s*false", re.IGNORECASE), ": False"),
     (
-        r":\s*null",
+        re.compile(r":\s*null", re.IGNORECASE),
         ": None",
     ),
 ]
@@ -1,10 +1,12 @@
 import asyncio
 import json
 import logging
-import re
 from ast import literal_eval
+from functools import lru_cache
 from typing import Any, Callable, Optional
 
+import httpx
+import openai
 from langchain.output_parsers import PydanticOutputParser
 from langchain_core.exceptions import OutputParserException
 from llama_index.core import PromptTemplate
@@ -19,13 +21,24 @@ from llama_index.core.base.llms.types import (
 from llama_index.core.chat_engine.types import StreamingAgentChatResponse
 from llama_index.core.llms.llm import LLM
 from llama_index.core.memory import ChatMemoryBuffer
-from pydantic import BaseModel
-from tenacity import before_log, retry, stop_after_attempt, wait_fixed
+from llama_index.llms.openai import OpenAI
+from pydantic import BaseModel, ValidationError
+from tenacity import (
+    RetryCallState,
+    before_log,
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
 from src.invocations.constants import (
+    JSON_LITERAL_PATTERN,
+    JSON_LITERAL_REPLACEMENTS,
     REPLACEMENT_PATTERNS,
     STOP_AFTER_ATTEMPT,
-    WAIT_FIXED,
+    WAIT_EXPONENTIAL_MAX,
+    WAIT_EXPONENTIAL_MULTIPLIER,
 )
 from src.invocations.prompts import (
     DEFAULT_CHOICE_VALIDATION_PROMPT_TEMPLATE,
@@ -36,6 +49,41 @@ from src.invocations.types import InvocationCallable
 
 logger = logging.getLogger(__name__)
 
+# Network / provider failures that may succeed if the same request is sent again
+TRANSIENT_ERRORS: tuple[type[BaseException], ...] = (
+    httpx.TransportError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+# Malformed or invalid responses (parsing, Pydantic and validation_callable errors),
+# worth resampling but not worth waiting for
+RESPONSE_ERRORS: tuple[type[BaseException], ...] = (ValueError, SyntaxError)
+
+_wait_transient = wait_random_exponential(
+    multiplier=WAIT_EXPONENTIAL_MULTIPLIER, max=WAIT_EXPONENTIAL_MAX
+)
+
+
+def _backoff(retry_state: RetryCallState) -> float:
+    """Function for backing off with jitter on transient errors only, so a malformed \
+    response is resampled straight away.
+
+    Parameters
+    ----------
+    retry_state : RetryCallState
+        The state of the retried call.
+
+    Returns
+    -------
+    float
+        The number of seconds to wait before the next attempt.
+    """
+    if isinstance(retry_state.outcome.exception(), TRANSIENT_ERRORS):
+        return _wait_transient(retry_state)
+    return 0
+
 
 def decode_either(data: str) -> dict:
     """Function for decoding either JSON or YAML data.
@@ -53,14 +101,112 @@ def decode_either(data: str) -> dict:
     try:
         return json.loads(data)
     except json.JSONDecodeError:
-        for pattern in REPLACEMENT_PATTERNS:
-            data = re.sub(pattern[0], pattern[1], data, flags=re.IGNORECASE)
+        pass
+
+    # Most failures are only Python-cased literals, which the C JSON parser can take
+    # once repaired, leaving literal_eval as the last resort
+    repaired = JSON_LITERAL_PATTERN.sub(
+        lambda match: JSON_LITERAL_REPLACEMENTS.get(match[1], match[0]), data
+    )
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError:
+        for pattern, replacement in REPLACEMENT_PATTERNS:
+            data = pattern.sub(replacement, data)
         return literal_eval(data)
 
 
+def _log_prompt_cache_usage(response: CompletionResponse) -> None:
+    """Function for logging how much of the prompt the provider served from its \
+    prompt cache, when the raw response reports it (OpenAI and Anthropic).
+
+    Parameters
+    ----------
+    response : CompletionResponse
+        The response from the LLM.
+    """
+    usage = getattr(getattr(response, "raw", None), "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None)
+    if cached_tokens is None:
+        cached_tokens = getattr(usage, "cache_read_input_tokens", None)
+    if cached_tokens is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or getattr(
+        usage, "input_tokens", None
+    )
+    logger.info(f"Prompt cache: {cached_tokens}/{prompt_tokens} prompt tokens cached.")
+
+
+@lru_cache(maxsize=128)
+def _get_parser(pydantic_object: type[BaseModel]) -> tuple[PydanticOutputParser, str]:
+    """Function for getting a shared parser and its format instructions, so the \
+    JSON schema is only serialized once per Pydantic object.
+
+    Parameters
+    ----------
+    pydantic_object : type[BaseModel]
+        The Pydantic object to be used for the structured output.
+
+    Returns
+    -------
+    tuple[PydanticOutputParser, str]
+        The parser and its format instructions.
+    """
+    parser = PydanticOutputParser(pydantic_object=pydantic_object)
+    return parser, parser.get_format_instructions()
+
+
+def _parse_structured_response(
+    response_text: str,
+    pydantic_object: type[BaseModel],
+    parser: PydanticOutputParser,
+    validation_callable: Optional[Callable] = None,
+) -> BaseModel:
+    """Function for parsing a structured LLM response into its Pydantic object.
+
+    Parameters
+    ----------
+    response_text : str
+        The text of the response from the LLM.
+    pydantic_object : type[BaseModel]
+        The Pydantic object to be used for the structured output.
+    parser : PydanticOutputParser
+        The parser for the Pydantic object.
+    validation_callable : Optional[Callable], optional
+        A validation callable to be used for the structured output, by default None
+
+    Returns
+    -------
+    BaseModel
+        The structured output from the LLM.
+    """
+    logger.info(f"Structured invocation response: {response_text}")
+    response_str = str(response_text).strip()
+
+    try:
+        # pydantic-core parses and validates the JSON in a single compiled pass
+        response_object = pydantic_object.model_validate_json(response_str)
+    except ValidationError as e:
+        # Well-formed JSON that fails validation won't parse any better below
+        if any(error["type"] != "json_invalid" for error in e.errors()):
+            raise
+        try:
+            response_object = parser.parse(response_str)
+        except OutputParserException:
+            response_json = decode_either(response_str)
+            response_object = pydantic_object(**response_json)
+
+    if validation_callable:
+        response_object = validation_callable(response_object)  # type: ignore
+
+    return response_object  # type: ignore
+
+
 @retry(
     stop=stop_after_attempt(STOP_AFTER_ATTEMPT),
-    wait=wait_fixed(WAIT_FIXED),
+    wait=_backoff,
+    retry=retry_if_exception_type(TRANSIENT_ERRORS + RESPONSE_ERRORS),
     before=before_log(logger, logging.INFO),
 )
 def structured_invocation(
@@ -70,6 +216,7 @@ def structured_invocation(
     prompt_template: PromptTemplate = DEFAULT_STRUCTURED_PROMPT_TEMPLATE,
     llm_kwargs: dict[str, Any] = {},
     validation_callable: Optional[Callable] = None,
+    prompt: Optional[str] = None,
 ) -> BaseModel:
     """A function for invoking an LLM with a structured output. Defined separately from \
     Llama-Index built-in structured invocation due to some LLM modules structured output \
@@ -89,41 +236,94 @@ def structured_invocation(
         Inference kwargs passed to the LLM, by default {}
     validation_callable : Optional[Callable], optional
         A validation callable to be used for the structured output, by default None
+    prompt : Optional[str], optional
+        The already formatted prompt, skipping the prompt template, by default None
 
     Returns
     -------
     BaseModel
         The structured output from the LLM.
     """
-    parser = PydanticOutputParser(pydantic_object=pydantic_object)
+    parser, format_instructions = _get_parser(pydantic_object)
 
-    prompt = prompt_template.format(
-        context=context,
-        schema=parser.get_format_instructions(),
-    )
+    if prompt is None:
+        prompt = prompt_template.format(
+            context=context,
+            schema=format_instructions,
+        )
 
     response = llm.complete(
         prompt=prompt,
         **llm_kwargs,
     )
-    logger.info(f"Structured invocation response: {response}")
-    response_str = str(response.text).strip()
+    _log_prompt_cache_usage(response)
+    return _parse_structured_response(
+        response.text, pydantic_object, parser, validation_callable
+    )
 
-    try:
-        response_object = parser.parse(response_str)
-    except OutputParserException:
-        response_json = decode_either(response_str)
-        response_object = pydantic_object(**response_json)
 
-    if validation_callable:
-        response_object = validation_callable(response_object)  # type: ignore
+@retry(
+    stop=stop_after_attempt(STOP_AFTER_ATTEMPT),
+    wait=_backoff,
+    retry=retry_if_exception_type(TRANSIENT_ERRORS + RESPONSE_ERRORS),
+    before=before_log(logger, logging.INFO),
+)
+async def structured_invocation_async(
+    llm: LLM,
+    context: str,
+    pydantic_object: type[BaseModel],
+    prompt_template: PromptTemplate = DEFAULT_STRUCTURED_PROMPT_TEMPLATE,
+    llm_kwargs: dict[str, Any] = {},
+    validation_callable: Optional[Callable] = None,
+    prompt: Optional[str] = None,
+) -> BaseModel:
+    """The asynchronous counterpart of structured_invocation, awaiting the LLM's \
+    native async completion rather than blocking a thread.
 
-    return response_object  # type: ignore
+    Parameters
+    ----------
+    llm : LLM
+        The LLM module to be invoked.
+    context : str
+        The context of the prompt.
+    pydantic_object : type[BaseModel]
+        The Pydantic object to be used for the structured output.
+    prompt_template : PromptTemplate, optional
+        A prompt template for combining the context and Pydantic schema, by default DEFAULT_STRUCTURED_PROMPT_TEMPLATE
+    llm_kwargs : dict[str, Any], optional
+        Inference kwargs passed to the LLM, by default {}
+    validation_callable : Optional[Callable], optional
+        A validation callable to be used for the structured output, by default None
+    prompt : Optional[str], optional
+        The already formatted prompt, skipping the prompt template, by default None
+
+    Returns
+    -------
+    BaseModel
+        The structured output from the LLM.
+    """
+    parser, format_instructions = _get_parser(pydantic_object)
+
+    if prompt is None:
+        prompt = prompt_template.format(
+            context=context,
+            schema=format_instructions,
+        )
+
+    response = await llm.acomplete(
+        prompt=prompt,
+        **llm_kwargs,
+    )
+    _log_prompt_cache_usage(response)
+    return _parse_structured_response(
+        response.text, pydantic_object, parser, validation_callable
+    )
 
 
 @retry(
     stop=stop_after_attempt(STOP_AFTER_ATTEMPT),
-    wait=wait_fixed(WAIT_FIXED),
+    wait=_backoff,
+    retry=retry_if_exception_type(TRANSIENT_ERRORS),
     before=before_log(logger, logging.INFO),
 )
 def non_structured_invocation(
@@ -148,6 +348,7 @@ def non_structured_invocation(
         The response from the LLM.
     """
     response: CompletionResponse = llm.complete(prompt=prompt, **inference_kwargs)
+    _log_prompt_cache_usage(response)
     response_str = str(response)
 
     return response_str
@@ -155,7 +356,103 @@ def non_structured_invocation(
 
 @retry(
     stop=stop_after_attempt(STOP_AFTER_ATTEMPT),
-    wait=wait_fixed(WAIT_FIXED),
+    wait=_backoff,
+    retry=retry_if_exception_type(TRANSIENT_ERRORS),
+    before=before_log(logger, logging.INFO),
+)
+async def non_structured_invocation_async(
+    llm: LLM,
+    prompt: str,
+    inference_kwargs: dict[str, Any] = {},
+) -> str:
+    """The asynchronous counterpart of non_structured_invocation.
+
+    Parameters
+    ----------
+    llm : LLM
+        The LLM module to be invoked.
+    prompt : str
+        The prompt to be used for the LLM.
+    inference_kwargs : dict[str, Any], optional
+        Inference kwargs passed to the LLM, by default {}
+
+    Returns
+    -------
+    str
+        The response from the LLM.
+    """
+    response: CompletionResponse = await llm.acomplete(
+        prompt=prompt, **inference_kwargs
+    )
+    _log_prompt_cache_usage(response)
+    response_str = str(response)
+
+    return response_str
+
+
+def supports_n_sampling(llm: LLM) -> bool:
+    """Function for checking whether an LLM module can return several completions \
+    for one request through the `n` parameter.
+
+    Parameters
+    ----------
+    llm : LLM
+        The LLM module to be invoked.
+
+    Returns
+    -------
+    bool
+        Whether the LLM module supports n-sampling.
+    """
+    return isinstance(llm, OpenAI)
+
+
+@retry(
+    stop=stop_after_attempt(STOP_AFTER_ATTEMPT),
+    wait=_backoff,
+    retry=retry_if_exception_type(TRANSIENT_ERRORS),
+    before=before_log(logger, logging.INFO),
+)
+async def sampled_invocation_async(
+    llm: LLM,
+    prompt: str,
+    n: int,
+    inference_kwargs: dict[str, Any] = {},
+) -> list[str]:
+    """Function for sampling several completions of the same prompt in a single \
+    request, so the provider only has to process the prompt once.
+
+    Parameters
+    ----------
+    llm : LLM
+        The LLM module to be invoked, see supports_n_sampling.
+    prompt : str
+        The prompt to be used for the LLM.
+    n : int
+        The number of completions to sample.
+    inference_kwargs : dict[str, Any], optional
+        Inference kwargs passed to the LLM, by default {}
+
+    Returns
+    -------
+    list[str]
+        The sampled responses from the LLM.
+    """
+    response: CompletionResponse = await llm.acomplete(
+        prompt=prompt, n=n, **inference_kwargs
+    )
+    _log_prompt_cache_usage(response)
+    # The wrapped response only carries the first choice, the rest are on the raw one
+    return [
+        choice.message.content if hasattr(choice, "message") else choice.text
+        for choice in response.raw.choices
+    ]
+
+
+@retry(
+    stop=stop_after_attempt(STOP_AFTER_ATTEMPT),
+    wait=_backoff,
+    retry=retry_if_exception_type(TRANSIENT_ERRORS),
     before=before_log(logger, logging.INFO),
 )
 def non_structured_streamed_invocation(
@@ -187,23 +484,29 @@ def non_structured_streamed_invocation(
     )
 
     def wrapped_gen(response: CompletionResponseGen) -> ChatResponseGen:
-        full_response = ""
         for token in response:
             if token.delta:
-                full_response += token.delta
                 yield ChatResponse(
                     message=ChatMessage(content=token.text, role=MessageRole.ASSISTANT),
                     delta=token.delta,
                 )
 
-        if memory:
-            assistant_message = ChatMessage(
-                content=full_response, role=MessageRole.ASSISTANT
-            )
-            memory.put(assistant_message)
+    def wrapped_gen_to_memory(response: CompletionResponseGen) -> ChatResponseGen:
+        # Joined once at the end, rather than copying the whole response per token
+        response_parts: list[str] = []
+        for chat_response in wrapped_gen(response):
+            response_parts.append(chat_response.delta)
+            yield chat_response
 
+        assistant_message = ChatMessage(
+            content="".join(response_parts), role=MessageRole.ASSISTANT
+        )
+        memory.put(assistant_message)
+
+    # Only buffer the response when there is a memory to write it to
+    chat_stream = wrapped_gen_to_memory(response) if memory else wrapped_gen(response)
     return StreamingAgentChatResponse(
-        chat_stream=wrapped_gen(response),
+        chat_stream=chat_stream,
         sources=[],
         source_nodes=[],
         is_writing_to_memory=False,
@@ -220,6 +523,7 @@ class MultiInvocationWithValidation:
         inference_kwargs: dict[str, Any] = {},
         prompt_template: PromptTemplate = DEFAULT_CHOICE_VALIDATION_PROMPT_TEMPLATE,
         timeout: int = 30,
+        max_concurrency: int = 10,
     ):
         """A class for validating multiple invocations.
 
@@ -235,18 +539,18 @@ class MultiInvocationWithValidation:
             The prompt template used for the validation prompt, by default DEFAULT_CHOICE_VALIDATION_PROMPT_TEMPLATE
         timeout : int, optional
             The timeout for each invocation task, by default 30
+        max_concurrency : int, optional
+            The maximum number of LLM requests in flight across all calls, by default 10
         """
         self.llm = llm
         self.choices = choices
         self.inference_kwargs = inference_kwargs
         self.prompt_template = prompt_template
         self._timeout = timeout
+        # Shared by every call on this instance, so bursts of concurrent requests queue
+        # here instead of tripping the provider's rate limits
+        self._semaphore = asyncio.Semaphore(max_concurrency)
 
-    @retry(
-        stop=stop_after_attempt(STOP_AFTER_ATTEMPT),
-        wait=wait_fixed(WAIT_FIXED),
-        before=before_log(logger, logging.INFO),
-    )
     async def validate(self, llm: LLM, prompt: str, choices: Choices) -> Choice:
         """A function for validating the choices.
 
@@ -265,18 +569,20 @@ class MultiInvocationWithValidation:
             The validated choice.
         """
         validator_llm = self.llm or llm
+        # Formatted once, structured_invocation_async retries the call itself
         context = self.prompt_template.format(prompt=prompt, choices=str(choices))
 
         def validation_callable(response: ValidatorChoice) -> Choice:
             return choices.get_choice_by_identifier(response.identifier)
 
-        response: Choice = structured_invocation(
-            llm=validator_llm,
-            context=context,
-            pydantic_object=self._pydantic_object,
-            llm_kwargs=self.inference_kwargs,
-            validation_callable=validation_callable,
-        )
+        async with self._semaphore:
+            response: Choice = await structured_invocation_async(
+                llm=validator_llm,
+                context=context,
+                pydantic_object=self._pydantic_object,
+                llm_kwargs=self.inference_kwargs,
+                validation_callable=validation_callable,
+            )
         return response
 
     async def structured_invocation(
@@ -307,29 +613,59 @@ class MultiInvocationWithValidation:
         BaseModel
             The structured output from the LLM.
         """
-        parser = PydanticOutputParser(pydantic_object=pydantic_object)
+        parser, format_instructions = _get_parser(pydantic_object)
         prompt = prompt_template.format(
             context=context,
-            schema=parser.get_format_instructions(),
+            schema=format_instructions,
         )
 
         logger.info(f"Structured invocation prompt: {prompt}")
 
+        results = []
+        errors: list[BaseException] = []
+        if supports_n_sampling(llm):
+            responses = await self._invocation_task(
+                sampled_invocation_async, llm, prompt, self.choices, llm_kwargs
+            )
+            for response in responses:
+                try:
+                    results.append(
+                        _parse_structured_response(response, pydantic_object, parser)
+                    )
+                except Exception as e:
+                    # Unparsable or rejected samples are dropped, the rest still count
+                    logger.info(f"Discarding sampled response: {e}")
+                    errors.append(e)
+
+        # Any choices the sampled request couldn't provide are invoked individually
         tasks = []
-        for _ in range(self.choices):
+        for _ in range(self.choices - len(results)):
             tasks.append(
                 self._invocation_task(
-                    structured_invocation,
+                    structured_invocation_async,
                     llm,
                     context,
                     pydantic_object,
                     prompt_template,
                     llm_kwargs,
+                    prompt=prompt,
                 )
             )
-        results = await asyncio.gather(*tasks)
+        for outcome in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(outcome, BaseException):
+                errors.append(outcome)
+            else:
+                results.append(outcome)
+
+        # Only fail once no valid choice is left at all
+        if not results:
+            raise errors[-1]
+
+        # With a single choice there is nothing for the validator to pick between
+        if len(results) == 1:
+            return results[0]
 
-        choices = Choices(choices=[Choice(choice=result) for result in results])
+        choices = Choices.from_outputs(results)
         choice = await self.validate(llm, prompt, choices)
         return choice.choice
 
@@ -356,20 +692,31 @@ class MultiInvocationWithValidation:
             The response from the LLM.
         """
         logger.info(f"Non-structured invocation prompt: {prompt}")
-        tasks = []
-        for _ in range(self.choices):
-            tasks.append(
-                self._invocation_task(
-                    structured_invocation, llm, prompt, inference_kwargs
-                )
+        if supports_n_sampling(llm):
+            results = await self._invocation_task(
+                sampled_invocation_async, llm, prompt, self.choices, inference_kwargs
             )
-        results = await asyncio.gather(*tasks)
-        choices = Choices(choices=[Choice(choice=result) for result in results])
+        else:
+            tasks = []
+            for _ in range(self.choices):
+                tasks.append(
+                    self._invocation_task(
+                        non_structured_invocation_async, llm, prompt, inference_kwargs
+                    )
+                )
+            results = await asyncio.gather(*tasks)
+        # With a single choice there is nothing for the validator to pick between
+        if len(results) == 1:
+            return results[0]
+
+        choices = Choices.from_outputs(results)
         choice = await self.validate(llm, prompt, choices)
         return choice.choice
 
-    async def _invocation_task(self, invocation_call: InvocationCallable, *args):
-        """A function for running an invocation call in a separate task.
+    async def _invocation_task(
+        self, invocation_call: InvocationCallable, *args, **kwargs
+    ):
+        """A function for awaiting an invocation call with the task timeout.
 
         Parameters
         ----------
@@ -377,16 +724,18 @@ class MultiInvocationWithValidation:
             The invocation call to be run.
         *args
             The arguments to be passed to the invocation call.
+        **kwargs
+            The keyword arguments to be passed to the invocation call.
 
         Returns
         -------
         Any
             The result of the invocation call
         """
-        return await asyncio.wait_for(
-            asyncio.get_event_loop().run_in_executor(None, invocation_call, *args),
-            timeout=self._timeout,
-        )
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                invocation_call(*args, **kwargs), timeout=self._timeout
+            )
 
 
 invocation_validator = MultiInvocationWithValidation()
@@ -1,6 +1,8 @@
 from llama_index.core import PromptTemplate
 
-DEFAULT_STRUCTURED_PROMPT_TEMPLATE = PromptTemplate("{context}\n\n" "{schema}")
+# Everything static leads and the dynamic fields trail, so providers with automatic
+# prefix caching can reuse the schema instructions and the rubric across calls
+DEFAULT_STRUCTURED_PROMPT_TEMPLATE = PromptTemplate("{schema}\n\n" "{context}")
 
 DEFAULT_CHOICE_VALIDATION_PROMPT_TEMPLATE = PromptTemplate(
     "# MASTER SYSTEM\n"
@@ -1,6 +1,8 @@
+import os
 import uuid
+from functools import cached_property
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class Choice(BaseModel):
@@ -12,16 +14,42 @@ class Choice(BaseModel):
 
 
 class Choices(BaseModel):
-    choices: list[Choice]
+    # Immutable, so the rendered string and index can be cached for its lifetime
+    model_config = ConfigDict(frozen=True)
+
+    choices: tuple[Choice, ...]
+
+    @classmethod
+    def from_outputs(cls, outputs: list[str | BaseModel]) -> "Choices":
+        # The outputs were produced and validated locally, so skip re-validating them,
+        # and draw the identifiers' random bytes with a single urandom call
+        random_bytes = os.urandom(16 * len(outputs))
+        return cls.model_construct(
+            choices=tuple(
+                Choice.model_construct(
+                    identifier=uuid.UUID(bytes=random_bytes[i : i + 16], version=4),
+                    choice=output,
+                )
+                for i, output in zip(range(0, len(random_bytes), 16), outputs)
+            )
+        )
+
+    @cached_property
+    def _rendered(self) -> str:
+        return "\n\n".join(str(choice) for choice in self.choices)
 
     def __str__(self) -> str:
-        return "\n\n".join([str(choice) for choice in self.choices])
+        return self._rendered
+
+    @cached_property
+    def _by_identifier(self) -> dict[uuid.UUID, Choice]:
+        return {choice.identifier: choice for choice in self.choices}
 
     def get_choice_by_identifier(self, identifier: uuid.UUID) -> Choice:
-        for choice in self.choices:
-            if choice.identifier == identifier:
-                return choice
-        raise ValueError(f"Choice with identifier {identifier} not found.")
+        try:
+            return self._by_identifier[identifier]
+        except KeyError:
+            raise ValueError(f"Choice with identifier {identifier} not found.")
 
 
 class Step(BaseModel):
@@ -1,10 +1,11 @@
-from typing import Any, Callable, Union
+from typing import Any, Awaitable, Callable, Union
 
-from llama_index.core import PromptTemplate
 from llama_index.core.llms.llm import LLM
 from pydantic import BaseModel
 
 InvocationCallable = Union[
-    Callable[[LLM, str, type[BaseModel], PromptTemplate, dict[str, Any]], BaseModel],
-    Callable[[LLM, str, dict[str, Any]], str],
+    # Structured invocations also take optional validation_callable / prompt kwargs
+    Callable[..., Awaitable[BaseModel]],
+    Callable[[LLM, str, dict[str, Any]], Awaitable[str]],
+    Callable[[LLM, str, int, dict[str, Any]], Awaitable[list[str]]],
 ]
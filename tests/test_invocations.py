@@ -0,0 +1,25 @@
+import unittest
+
+from src.invocations.invocations import decode_either
+
+
+class TestDecodeEither(unittest.TestCase):
+    def test_repairs_python_literals(self):
+        self.assertEqual(
+            decode_either('{"a": True, "b": False, "c": None, "d": [True, None]}'),
+            {"a": True, "b": False, "c": None, "d": [True, None]},
+        )
+
+    def test_leaves_literal_words_inside_strings(self):
+        decoded = decode_either(
+            '{"a": True, "b": None, "c": "Note: none of these: True", '
+            '"d": "escaped \\" False, null"}'
+        )
+        self.assertEqual(decoded["c"], "Note: none of these: True")
+        self.assertEqual(decoded["d"], 'escaped " False, null')
+        self.assertIs(decoded["a"], True)
+        self.assertIsNone(decoded["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()